@@ -1,15 +1,42 @@
-from flask import Flask, request, jsonify, send_from_directory, g
+from flask import Flask, Response, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
+from flask_compress import Compress
 import boto3
+from cachetools import TTLCache
+from botocore.config import Config
+import gzip
+import hashlib
+import hmac
+import orjson
 import os
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 from flask_swagger_ui import get_swaggerui_blueprint
+from werkzeug.http import parse_range_header
 
 # Charger les variables d'environnement depuis .env
 load_dotenv()
 
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Sérialisation JSON via orjson (implémentation C) pour jsonify et request.get_json"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Configuration Storj depuis variables d'environnement
 ACCESS_KEY = os.getenv("STORJ_S3_ACCESS_KEY")
@@ -18,23 +45,324 @@ ENDPOINT = os.getenv("STORJ_S3_ENDPOINT")
 BUCKET = os.getenv("STORJ_S3_BUCKET")
 BACKEND_TOKEN = os.getenv("BACKEND_TOKEN")
 
+# En-tête Authorization attendu, calculé une seule fois au démarrage
+_EXPECTED_AUTH = f"Bearer {BACKEND_TOKEN}".encode() if BACKEND_TOKEN else None
+
 # Statistiques de bande passante
-bandwidth_stats = {
-    "total_bytes_sent": 0,
-    "total_bytes_received": 0,
-    "total_requests": 0,
-    "start_time": datetime.utcnow().isoformat(),
-    "endpoints": {}
-}
-
-# Initialiser le client S3
+# Chaque thread incrémente ses propres compteurs ; /stats les agrège à la demande
+START_TIME = datetime.utcnow().isoformat()
+COUNTER_KEYS = ("total_bytes_sent", "total_bytes_received", "total_requests")
+ENDPOINT_COUNTER_KEYS = ("requests", "bytes_sent", "bytes_received")
+
+# Compteurs par endpoint : nombre fixe de slots, chaque endpoint reçoit un slot
+# stable à sa première requête ; une fois les slots épuisés, les nouveaux
+# endpoints partagent le dernier slot ("other")
+ENDPOINT_SLOTS = 32
+OVERFLOW_SLOT = ENDPOINT_SLOTS - 1
+OVERFLOW_ENDPOINT = "other"
+
+_local = threading.local()
+_counters_lock = threading.Lock()
+_all_counters = []
+_endpoint_slots = {}
+_slot_endpoints = []
+
+
+def _new_endpoint_counters():
+    return dict.fromkeys(ENDPOINT_COUNTER_KEYS, 0)
+
+
+def _new_counters():
+    counters = dict.fromkeys(COUNTER_KEYS, 0)
+    counters["endpoints"] = [_new_endpoint_counters() for _ in range(ENDPOINT_SLOTS)]
+    return counters
+
+
+def thread_counters():
+    """Retourne les compteurs du thread courant (créés au premier appel)"""
+    counters = getattr(_local, "counters", None)
+    if counters is None:
+        counters = _local.counters = _new_counters()
+        with _counters_lock:
+            _all_counters.append(counters)
+    return counters
+
+
+def endpoint_slot(endpoint):
+    """Retourne le slot de compteurs attribué à un endpoint"""
+    slot = _endpoint_slots.get(endpoint)
+    if slot is not None:
+        return slot
+    if len(_slot_endpoints) >= OVERFLOW_SLOT:
+        return OVERFLOW_SLOT
+
+    with _counters_lock:
+        slot = _endpoint_slots.get(endpoint)
+        if slot is None:
+            if len(_slot_endpoints) >= OVERFLOW_SLOT:
+                return OVERFLOW_SLOT
+            slot = len(_slot_endpoints)
+            _slot_endpoints.append(endpoint)
+            _endpoint_slots[endpoint] = slot
+    return slot
+
+
+def aggregate_bandwidth_stats():
+    """Agrège les compteurs de tous les threads"""
+    stats = dict.fromkeys(COUNTER_KEYS, 0)
+    stats["start_time"] = START_TIME
+    slots = [_new_endpoint_counters() for _ in range(ENDPOINT_SLOTS)]
+    with _counters_lock:
+        all_counters = list(_all_counters)
+
+    for counters in all_counters:
+        for key in COUNTER_KEYS:
+            stats[key] += counters[key]
+        for total, data in zip(slots, counters["endpoints"]):
+            for key in ENDPOINT_COUNTER_KEYS:
+                total[key] += data[key]
+
+    # Un slot n'est incrémenté qu'après son attribution : les noms lus ici
+    # couvrent donc tous les slots déjà utilisés
+    names = list(_slot_endpoints)
+    stats["endpoints"] = {}
+    for slot, data in enumerate(slots):
+        if not data["requests"]:
+            continue
+        name = names[slot] if slot < len(names) else OVERFLOW_ENDPOINT
+        stats["endpoints"][name] = data
+
+    return stats
+
+
+# Pool de connexions dimensionné sur les threads Gunicorn (cf. gunicorn.conf.py)
+# et sur le pool de lectures parallèles de /canvas/bulk
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", 8))
+BULK_MAX_WORKERS = int(os.getenv("BULK_MAX_WORKERS", 32))
+s3_config = Config(
+    max_pool_connections=max(GUNICORN_THREADS * 2, BULK_MAX_WORKERS),
+    retries={"max_attempts": 3, "mode": "standard"},
+    tcp_keepalive=True
+)
+
+# Initialiser le client S3 (partagé entre les threads)
 session = boto3.session.Session()
 s3 = session.client(
     service_name="s3",
     aws_access_key_id=ACCESS_KEY,
     aws_secret_access_key=SECRET_KEY,
-    endpoint_url=ENDPOINT
+    endpoint_url=ENDPOINT,
+    config=s3_config
 )
+list_objects_paginator = s3.get_paginator("list_objects_v2")
+
+# Codes renvoyés par S3 quand une écriture conditionnelle (If-Match / If-None-Match) échoue
+CONDITIONAL_WRITE_FAILURES = {"PreconditionFailed", "ConditionalRequestConflict"}
+
+
+def s3_error_code(error):
+    """Code d'erreur S3 porté par une ClientError"""
+    return error.response.get("Error", {}).get("Code")
+
+
+def iter_keys():
+    """Parcourt toutes les clés du bucket, page par page (au-delà de 1000 objets)"""
+    pages = list_objects_paginator.paginate(
+        Bucket=BUCKET,
+        PaginationConfig={"PageSize": 1000}
+    )
+    for page in pages:
+        for obj in page.get("Contents", ()):
+            yield obj["Key"]
+
+
+# Extension des fichiers canvas
+CANVAS_EXT = ".canvas"
+
+# Clés rejetées sans interroger S3 : trop longues, ou avec un segment de
+# chemin vide, relatif ou sans nom avant l'extension
+S3_MAX_KEY_LENGTH = 1024
+INVALID_KEY_PARTS = frozenset(("", ".", "..", CANVAS_EXT))
+
+
+def canvas_key(filename):
+    """Ajoute l'extension .canvas si elle n'est pas présente ; None si le nom est invalide"""
+    key = filename if filename.endswith(CANVAS_EXT) else filename + CANVAS_EXT
+    if len(key.encode("utf-8")) > S3_MAX_KEY_LENGTH or not INVALID_KEY_PARTS.isdisjoint(key.split("/")):
+        return None
+    return key
+
+
+# Cache en mémoire des petits canvas, indexé par clé S3 et validé par ETag.
+# Taille bornée en octets de contenu (pour chaque worker Gunicorn)
+CANVAS_CACHE_BYTES = int(os.getenv("CANVAS_CACHE_BYTES", 64 * 1024 * 1024))
+CANVAS_CACHE_TTL = float(os.getenv("CANVAS_CACHE_TTL", 30))
+CANVAS_CACHE_MAX_OBJECT_SIZE = min(1024 * 1024, CANVAS_CACHE_BYTES)
+
+# Stockage des canvas compressés en gzip (désactivé par défaut : les fichiers
+# restent lisibles tels quels par les autres clients du bucket, ex. Obsidian)
+CANVAS_GZIP = os.getenv("CANVAS_GZIP", "false").lower() in ("1", "true", "yes")
+
+_canvas_cache = TTLCache(maxsize=CANVAS_CACHE_BYTES, ttl=CANVAS_CACHE_TTL, getsizeof=lambda entry: len(entry["body"]))
+_canvas_cache_lock = threading.Lock()
+# Incrémenté à chaque écriture : une lecture commencée avant une écriture
+# concurrente ne doit pas remettre l'ancienne version en cache
+_canvas_generation = 0
+
+
+def cached_canvas(key):
+    """Retourne l'entrée en cache d'un canvas, ou None"""
+    with _canvas_cache_lock:
+        return _canvas_cache.get(key)
+
+
+def canvas_generation():
+    """Génération courante du cache, à relever avant de lire un canvas dans S3"""
+    with _canvas_cache_lock:
+        return _canvas_generation
+
+
+def read_object_body(response):
+    """Lit le corps d'une réponse get_object, décompressé si l'objet est stocké en gzip"""
+    body = response["Body"].read()
+    if response.get("ContentEncoding") == "gzip":
+        body = gzip.decompress(body)
+    return body
+
+
+def cache_canvas(key, response, generation):
+    """Lit le corps d'une réponse get_object et le met en cache (s'il est petit et sans écriture concurrente)"""
+    body = read_object_body(response)
+    # Taille annoncée par S3, sauf pour un objet compressé (taille décompressée)
+    size = response["ContentLength"]
+    if response.get("ContentEncoding") == "gzip":
+        size = len(body)
+    entry = {
+        "etag": response["ETag"].strip('"'),
+        "body": body,
+        "size": size,
+        "content_type": response.get("ContentType", "application/octet-stream"),
+        "last_modified": response["LastModified"]
+    }
+    if size <= CANVAS_CACHE_MAX_OBJECT_SIZE:
+        with _canvas_cache_lock:
+            if _canvas_generation == generation:
+                _canvas_cache[key] = entry
+    return entry
+
+
+def invalidate_canvas(key):
+    global _canvas_generation
+    with _canvas_cache_lock:
+        _canvas_generation += 1
+        _canvas_cache.pop(key, None)
+
+
+def fetch_canvas(key):
+    """Retourne l'entrée d'un canvas depuis le cache, ou la lit depuis S3"""
+    entry = cached_canvas(key)
+    if entry is None:
+        generation = canvas_generation()
+        entry = cache_canvas(key, s3.get_object(Bucket=BUCKET, Key=key), generation)
+    return entry
+
+
+def encode_canvas(content):
+    """Sérialise le contenu d'un canvas pour S3 : JSON compact, compressé si CANVAS_GZIP"""
+    if isinstance(content, (dict, list)):
+        body = orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    else:
+        body = str(content).encode("utf-8")
+    if CANVAS_GZIP:
+        return gzip.compress(body, compresslevel=4), {"ContentEncoding": "gzip"}
+    return body, {}
+
+
+def decode_canvas(body):
+    """Décode le JSON d'un canvas, ou renvoie le texte brut s'il n'est pas valide"""
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return body.decode("utf-8")
+
+
+# Lectures S3 parallèles pour /canvas/bulk (le client S3 est partagé entre threads)
+BULK_MAX_FILES = 100
+bulk_executor = ThreadPoolExecutor(max_workers=BULK_MAX_WORKERS, thread_name_prefix="canvas-bulk")
+
+
+# Taille des blocs lus depuis S3 pour les réponses streamées
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def stream_object(response):
+    """Renvoie le corps d'un objet S3 bloc par bloc, sans le charger en mémoire"""
+    body = response["Body"]
+    chunks = body.iter_chunks(STREAM_CHUNK_SIZE)
+    headers = {"Content-Length": str(response["ContentLength"])}
+    if response.get("ContentEncoding") == "gzip":
+        headers["Vary"] = "Accept-Encoding"
+        if request.accept_encodings["gzip"]:
+            # Objet stocké compressé : transmis tel quel, décompressé par le client
+            headers["Content-Encoding"] = "gzip"
+        else:
+            # Client sans gzip : décompression au fil du flux, taille finale inconnue
+            chunks = _gunzip_chunks(chunks)
+            del headers["Content-Length"]
+    stream = Response(
+        chunks,
+        mimetype=response.get("ContentType", "application/octet-stream"),
+        headers=headers
+    )
+    stream.call_on_close(body.close)
+    return stream
+
+
+def _gunzip_chunks(chunks):
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def decompressed_range(entry, byte_range):
+    """Renvoie une plage d'octets du contenu décompressé d'un canvas (206), ou 416"""
+    ranges = parse_range_header(byte_range)
+    bounds = ranges.range_for_length(entry["size"]) if ranges else None
+    if bounds is None:
+        return jsonify({"error": f"Invalid range '{byte_range}'"}), 416
+    start, stop = bounds
+    partial = Response(entry["body"][start:stop], status=206, mimetype=entry["content_type"])
+    partial.headers["Content-Range"] = ranges.to_content_range_header(entry["size"])
+    partial.set_etag(entry["etag"])
+    return partial
+
+
+def wants_raw():
+    """Le client demande le contenu brut (?raw=1) plutôt que l'enveloppe JSON"""
+    return request.args.get("raw") == "1"
+
+
+# Type MIME à demander dans Accept pour recevoir l'enveloppe JSON d'un canvas,
+# et suffixe distinguant son ETag de celui du contenu stocké
+ENVELOPE_MIMETYPE = "application/x-envelope+json"
+ENVELOPE_ETAG_SUFFIX = "-envelope"
+
+
+def wants_envelope():
+    """Le client demande explicitement l'enveloppe JSON (Accept: application/x-envelope+json)"""
+    return any(mimetype == ENVELOPE_MIMETYPE and quality for mimetype, quality in request.accept_mimetypes)
+
+
+def serve_stored_canvas(content_type):
+    """Indique si le canvas doit être renvoyé tel que stocké (brut, ou JSON sans enveloppe demandée)"""
+    if wants_raw():
+        return True
+    return content_type == "application/json" and not wants_envelope()
 
 
 # Configuration Swagger UI
@@ -52,59 +380,174 @@ swaggerui_blueprint = get_swaggerui_blueprint(
 app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
 
+# Flask-Compress suffixe les ETag forts des réponses compressées ("<etag>:gzip") ;
+# les clients renvoient donc ces formes dans If-None-Match / If-Match
+COMPRESSED_ETAG_SUFFIXES = (":gzip", ":br", ":zstd", ":deflate")
+
+
+def strip_compressed_etag(etag):
+    """Retire le suffixe de compression ajouté par Flask-Compress à un ETag"""
+    for suffix in COMPRESSED_ETAG_SUFFIXES:
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)]
+    return etag
+
+
+def matching_etag(etags, etag):
+    """Forme de l'ETag (nue ou compressée) contenue dans un If-None-Match, ou None"""
+    for candidate in (etag, *(etag + suffix for suffix in COMPRESSED_ETAG_SUFFIXES)):
+        if etags.contains(candidate):
+            return candidate
+    return None
+
+
+def s3_etag(etag):
+    """ETag de l'objet S3 correspondant à un ETag de réponse (compression et enveloppe retirées)"""
+    etag = strip_compressed_etag(etag)
+    if etag.endswith(ENVELOPE_ETAG_SUFFIX):
+        etag = etag[:-len(ENVELOPE_ETAG_SUFFIX)]
+    return etag
+
+
+def s3_if_match(header):
+    """Convertit l'If-Match d'un client en ETag S3"""
+    etag = header.strip()
+    if len(etag) >= 2 and etag.startswith('"') and etag.endswith('"'):
+        return '"' + s3_etag(etag[1:-1]) + '"'
+    return s3_etag(etag)
+
+
+def not_modified(etag, headers=None):
+    """Réponse 304 pour une version déjà connue du client"""
+    response = Response(status=304, headers=headers)
+    response.set_etag(etag)
+    return response
+
+
+# Spécification OpenAPI, lue une seule fois au démarrage
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openapi.yaml'), 'rb') as f:
+    _OPENAPI_BYTES = f.read()
+_OPENAPI_ETAG = hashlib.md5(_OPENAPI_BYTES).hexdigest()
+
+
 # Route pour servir le fichier OpenAPI
 @app.route('/openapi.yaml')
 def openapi_spec():
-    return send_from_directory('.', 'openapi.yaml')
+    headers = {'Cache-Control': 'public, max-age=300'}
+    # Répond 304 si le client a déjà la version courante, avant toute compression
+    known_etag = matching_etag(request.if_none_match, _OPENAPI_ETAG)
+    if known_etag:
+        return not_modified(known_etag, headers)
+
+    response = Response(_OPENAPI_BYTES, mimetype='application/yaml', headers=headers)
+    response.set_etag(_OPENAPI_ETAG)
+    return response
 
 
 # Middleware de suivi de bande passante
 @app.before_request
 def track_bandwidth_before():
     g.start_time = time.time()
-    # Comptabiliser les octets reçus (requête entrante)
-    if request.data:
-        bytes_received = len(request.data)
-        bandwidth_stats["total_bytes_received"] += bytes_received
-    elif request.form:
-        bytes_received = len(str(request.form).encode('utf-8'))
-        bandwidth_stats["total_bytes_received"] += bytes_received
+    # Comptabiliser les octets reçus (requête entrante) d'après Content-Length,
+    # sans lire ni recopier le corps
+    bytes_received = request.content_length or 0
+    g.bytes_in = bytes_received
+    thread_counters()["total_bytes_received"] += bytes_received
 
 
 @app.after_request
 def track_bandwidth_after(response):
-    # Comptabiliser les octets envoyés (réponse sortante)
-    if response.data:
-        bytes_sent = len(response.data)
-        bandwidth_stats["total_bytes_sent"] += bytes_sent
-
-    # Incrémenter le compteur de requêtes
-    bandwidth_stats["total_requests"] += 1
+    counters = thread_counters()
+    # Comptabiliser les octets envoyés (réponse sortante) sans lire le corps
+    # quand Content-Length est connu, ni bufferiser une réponse streamée
+    endpoint_counters = counters["endpoints"][endpoint_slot(request.endpoint or "unknown")]
+    content_length = response.headers.get("Content-Length")
+    if content_length is not None:
+        bytes_sent = int(content_length)
+    elif response.is_streamed:
+        # Taille inconnue d'avance (ex. flux compressé) : compter au fil de l'envoi
+        bytes_sent = 0
+        response.response = _count_streamed(response.response, counters, endpoint_counters)
+    else:
+        bytes_sent = len(response.get_data())
+    bytes_received = g.get("bytes_in", 0)
+
+    counters["total_bytes_sent"] += bytes_sent
+    counters["total_requests"] += 1
 
     # Statistiques par endpoint
-    endpoint = request.endpoint or "unknown"
-    if endpoint not in bandwidth_stats["endpoints"]:
-        bandwidth_stats["endpoints"][endpoint] = {
-            "requests": 0,
-            "bytes_sent": 0,
-            "bytes_received": 0
-        }
-
-    bandwidth_stats["endpoints"][endpoint]["requests"] += 1
-    if response.data:
-        bandwidth_stats["endpoints"][endpoint]["bytes_sent"] += len(response.data)
-    if request.data:
-        bandwidth_stats["endpoints"][endpoint]["bytes_received"] += len(request.data)
+    endpoint_counters["requests"] += 1
+    endpoint_counters["bytes_sent"] += bytes_sent
+    endpoint_counters["bytes_received"] += bytes_received
 
     return response
 
 
+def _count_streamed(chunks, counters, endpoint_counters):
+    for chunk in chunks:
+        counters["total_bytes_sent"] += len(chunk)
+        endpoint_counters["bytes_sent"] += len(chunk)
+        yield chunk
+
+
+# Compression gzip/brotli des réponses JSON/YAML de plus de 1 Ko, flux S3 compris.
+# Initialisée après track_bandwidth_after : Flask exécute les after_request en
+# ordre inverse, le suivi de bande passante voit donc la taille compressée.
+app.config.update(
+    COMPRESS_MIMETYPES=["application/json", ENVELOPE_MIMETYPE, "application/yaml"],
+    COMPRESS_ALGORITHM=["br", "gzip"],
+    COMPRESS_ALGORITHM_STREAMING=["gzip"],
+    COMPRESS_LEVEL=4,
+    COMPRESS_BR_LEVEL=4,
+    COMPRESS_MIN_SIZE=1024,
+    COMPRESS_REGISTER=False
+)
+compress = Compress(app)
+
+
+@app.after_request
+def compress_response(response):
+    # Content-Range désigne les octets non compressés : pas de compression des 206
+    if response.status_code == 206:
+        return response
+    return compress.after_request(response)
+
+
 # Middleware d'authentification
+# Endpoints et blueprints accessibles sans token
+PUBLIC_ENDPOINTS = {"health", "openapi_spec"}
+PUBLIC_BLUEPRINTS = {swaggerui_blueprint.name}
+
+
+# Réponses d'erreur constantes, construites une seule fois et renvoyées telles
+# quelles : elles ne doivent jamais être modifiées
+def _err(message, status):
+    # Vary déjà présent : Flask-Compress n'a pas à modifier la réponse partagée
+    return Response(
+        orjson.dumps({"error": message}),
+        status=status,
+        mimetype="application/json",
+        headers={"Vary": "Accept-Encoding"}
+    )
+
+
+_ERR_UNAUTHORIZED = _err("Unauthorized", 401)
+_ERR_MISSING_FILENAME = _err("Missing filename", 400)
+_ERR_MISSING_CONTENT = _err("Missing content", 400)
+_ERR_MISSING_FILENAMES = _err("Missing filenames", 400)
+_ERR_INVALID_FILENAME = _err("Invalid filename", 400)
+_ERR_NOT_FOUND = _err("Not found", 404)
+
+
+@app.before_request
 def check_auth():
-    if BACKEND_TOKEN:
-        auth = request.headers.get("Authorization")
-        if auth != f"Bearer {BACKEND_TOKEN}":
-            return jsonify({"error": "Unauthorized"}), 401
+    if _EXPECTED_AUTH is None:
+        return None
+    if request.endpoint in PUBLIC_ENDPOINTS or request.blueprint in PUBLIC_BLUEPRINTS:
+        return None
+    auth = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(auth, _EXPECTED_AUTH):
+        return _ERR_UNAUTHORIZED
     return None
 
 
@@ -118,12 +561,13 @@ def health():
     })
 
 
-@app.route("/stats", methods=["GET"])
-def get_stats():
-    """Retourne les statistiques de bande passante"""
-    auth_error = check_auth()
-    if auth_error:
-        return auth_error
+# Cache JSON de /stats, rafraîchi périodiquement par un thread de fond
+STATS_REFRESH_INTERVAL = float(os.getenv("STATS_REFRESH_INTERVAL", 2))
+
+
+def build_stats():
+    """Construit les statistiques de bande passante formatées"""
+    bandwidth_stats = aggregate_bandwidth_stats()
 
     # Calculer la durée de fonctionnement
     start_time = datetime.fromisoformat(bandwidth_stats["start_time"])
@@ -161,19 +605,35 @@ def get_stats():
             "kb_received": round(data["bytes_received"] / 1024, 2)
         }
 
-    return jsonify(stats)
+    return stats
+
+
+def refresh_stats_cache():
+    global _STATS_CACHE
+    _STATS_CACHE = orjson.dumps(build_stats(), option=orjson.OPT_SORT_KEYS)
+
+
+def _refresh_stats_loop():
+    while True:
+        time.sleep(STATS_REFRESH_INTERVAL)
+        refresh_stats_cache()
+
+
+refresh_stats_cache()
+threading.Thread(target=_refresh_stats_loop, name="stats-refresh", daemon=True).start()
+
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    """Retourne les statistiques de bande passante (mises en cache)"""
+    return Response(_STATS_CACHE, mimetype="application/json")
 
 
 @app.route("/listNotes", methods=["GET"])
 def list_notes():
     """Liste tous les fichiers du bucket"""
-    auth_error = check_auth()
-    if auth_error:
-        return auth_error
-    
     try:
-        response = s3.list_objects_v2(Bucket=BUCKET)
-        files = [obj["Key"] for obj in response.get("Contents", [])]
+        files = list(iter_keys())
         return jsonify({"files": files})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -182,25 +642,24 @@ def list_notes():
 @app.route("/readNote", methods=["POST"])
 def read_note():
     """Lit le contenu d'un fichier"""
-    auth_error = check_auth()
-    if auth_error:
-        return auth_error
-    
     data = request.get_json()
     filename = data.get("filename")
     
     if not filename:
-        return jsonify({"error": "Missing filename"}), 400
+        return _ERR_MISSING_FILENAME
     
     try:
         response = s3.get_object(Bucket=BUCKET, Key=filename)
-        content = response["Body"].read().decode("utf-8")
+        if wants_raw():
+            return stream_object(response)
+
+        content = read_object_body(response).decode("utf-8")
         return jsonify({
             "filename": filename,
             "content": content
         })
     except s3.exceptions.NoSuchKey:
-        return jsonify({"error": "Not found"}), 404
+        return _ERR_NOT_FOUND
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -208,16 +667,12 @@ def read_note():
 @app.route("/writeNote", methods=["POST"])
 def write_note():
     """Écrit ou met à jour un fichier"""
-    auth_error = check_auth()
-    if auth_error:
-        return auth_error
-
     data = request.get_json()
     filename = data.get("filename")
     content = data.get("content", "")
 
     if not filename:
-        return jsonify({"error": "Missing filename"}), 400
+        return _ERR_MISSING_FILENAME
 
     try:
         s3.put_object(
@@ -238,16 +693,8 @@ def write_note():
 @app.route("/canvas", methods=["GET"])
 def list_canvas():
     """Liste tous les fichiers .canvas"""
-    auth_error = check_auth()
-    if auth_error:
-        return auth_error
-
     try:
-        response = s3.list_objects_v2(Bucket=BUCKET)
-        canvas_files = [
-            obj["Key"] for obj in response.get("Contents", [])
-            if obj["Key"].endswith(".canvas")
-        ]
+        canvas_files = [key for key in iter_keys() if key.endswith(CANVAS_EXT)]
         return jsonify({
             "count": len(canvas_files),
             "files": canvas_files
@@ -259,85 +706,192 @@ def list_canvas():
 @app.route("/canvas/<path:filename>", methods=["GET"])
 def get_canvas(filename):
     """Récupère un fichier .canvas spécifique"""
-    auth_error = check_auth()
-    if auth_error:
-        return auth_error
-
-    # Ajouter l'extension .canvas si elle n'est pas présente
-    if not filename.endswith(".canvas"):
-        filename = f"{filename}.canvas"
+    filename = canvas_key(filename)
+    if filename is None:
+        return _ERR_INVALID_FILENAME
 
     try:
-        response = s3.get_object(Bucket=BUCKET, Key=filename)
-        content = response["Body"].read().decode("utf-8")
-
-        # Tenter de parser le JSON pour validation
-        import json
-        try:
-            canvas_data = json.loads(content)
-        except json.JSONDecodeError:
-            canvas_data = content
-
-        return jsonify({
+        byte_range = request.headers.get("Range") or request.args.get("range")
+        if byte_range:
+            # Canvas en cache : la plage est découpée dans le contenu décompressé
+            entry = cached_canvas(filename)
+            if entry is not None:
+                return decompressed_range(entry, byte_range)
+            # Objet possiblement compressé : S3 validerait la plage sur la taille
+            # compressée, elle est donc découpée après lecture complète
+            if CANVAS_GZIP:
+                try:
+                    head = s3.head_object(Bucket=BUCKET, Key=filename)
+                except s3.exceptions.ClientError as e:
+                    if s3_error_code(e) in ("404", "NoSuchKey"):
+                        return jsonify({"error": f"Canvas file '{filename}' not found"}), 404
+                    raise
+                if head.get("ContentEncoding") == "gzip":
+                    return decompressed_range(fetch_canvas(filename), byte_range)
+
+            # Lecture partielle : la plage est transmise telle quelle à S3
+            try:
+                response = s3.get_object(Bucket=BUCKET, Key=filename, Range=byte_range)
+            except s3.exceptions.ClientError as e:
+                if s3_error_code(e) == "InvalidRange":
+                    return jsonify({"error": f"Invalid range '{byte_range}'"}), 416
+                raise
+            if response.get("ContentEncoding") == "gzip":
+                # Objet compressé écrit sans CANVAS_GZIP : une tranche du flux gzip
+                # est inexploitable, la plage est découpée dans le contenu décompressé
+                response["Body"].close()
+                return decompressed_range(fetch_canvas(filename), byte_range)
+            partial = stream_object(response)
+            if "ContentRange" in response:
+                partial.status_code = 206
+                partial.headers["Content-Range"] = response["ContentRange"]
+            return partial
+
+        entry = cached_canvas(filename)
+        if entry is None:
+            generation = canvas_generation()
+            response = s3.get_object(Bucket=BUCKET, Key=filename)
+            # Les gros fichiers ne sont pas mis en cache : flux direct s'ils sont renvoyés tels quels
+            # (sauf s'ils sont compressés : X-Size doit porter la taille décompressée)
+            if (response["ContentLength"] > CANVAS_CACHE_MAX_OBJECT_SIZE
+                    and response.get("ContentEncoding") != "gzip"
+                    and serve_stored_canvas(response.get("ContentType"))):
+                etag = response["ETag"].strip('"')
+                known_etag = matching_etag(request.if_none_match, etag)
+                if known_etag:
+                    response["Body"].close()
+                    return not_modified(known_etag, {"Vary": "Accept"})
+                stream = stream_object(response)
+                stream.headers["X-Last-Modified"] = response["LastModified"].isoformat()
+                stream.headers["X-Size"] = str(response["ContentLength"])
+                stream.headers["Vary"] = "Accept"
+                stream.set_etag(etag)
+                return stream
+            entry = cache_canvas(filename, response, generation)
+
+        # Contenu stocké et enveloppe sont deux représentations distinctes :
+        # chacune a son ETag, et la réponse varie selon Accept
+        serve_stored = serve_stored_canvas(entry["content_type"])
+        etag = entry["etag"] if serve_stored else entry["etag"] + ENVELOPE_ETAG_SUFFIX
+
+        # Le client possède déjà cette version (ETag éventuellement suffixé par la compression)
+        known_etag = matching_etag(request.if_none_match, etag)
+        if known_etag:
+            return not_modified(known_etag, {"Vary": "Accept"})
+
+        # Octets stockés renvoyés sans décodage ni re-sérialisation
+        if serve_stored:
+            stored = Response(
+                entry["body"],
+                mimetype=entry["content_type"],
+                headers={
+                    "X-Last-Modified": entry["last_modified"].isoformat(),
+                    "X-Size": str(entry["size"]),
+                    "Vary": "Accept"
+                }
+            )
+            stored.set_etag(etag)
+            return stored
+
+        envelope = jsonify({
             "filename": filename,
-            "content": canvas_data,
-            "size": len(content),
-            "last_modified": response["LastModified"].isoformat()
+            "content": decode_canvas(entry["body"]),
+            "size": entry["size"],
+            "last_modified": entry["last_modified"].isoformat()
         })
+        envelope.mimetype = ENVELOPE_MIMETYPE
+        envelope.headers["Vary"] = "Accept"
+        envelope.set_etag(etag)
+        return envelope
     except s3.exceptions.NoSuchKey:
         return jsonify({"error": f"Canvas file '{filename}' not found"}), 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/canvas/bulk", methods=["POST"])
+def bulk_canvas():
+    """Récupère plusieurs fichiers .canvas en parallèle"""
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return _ERR_MISSING_FILENAMES
+    filenames = data.get("filenames")
+
+    if not filenames or not isinstance(filenames, list) or not all(
+        isinstance(name, str) and name for name in filenames
+    ):
+        return _ERR_MISSING_FILENAMES
+
+    keys = list(dict.fromkeys(canvas_key(name) for name in filenames))
+    if None in keys:
+        return _ERR_INVALID_FILENAME
+    if len(keys) > BULK_MAX_FILES:
+        return jsonify({"error": f"Too many files (max {BULK_MAX_FILES})"}), 400
+
+    try:
+        # Latence totale ≈ la plus lente des lectures plutôt que leur somme
+        futures = {key: bulk_executor.submit(fetch_canvas, key) for key in keys}
+
+        canvases = {}
+        errors = {}
+        for key, future in futures.items():
+            try:
+                canvases[key] = decode_canvas(future.result()["body"])
+            except s3.exceptions.NoSuchKey:
+                errors[key] = "Not found"
+            except Exception as e:
+                errors[key] = str(e)
+
+        return jsonify({
+            "count": len(canvases),
+            "canvases": canvases,
+            "errors": errors
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route("/canvas", methods=["POST"])
 def create_canvas():
     """Crée un nouveau fichier .canvas"""
-    auth_error = check_auth()
-    if auth_error:
-        return auth_error
-
     data = request.get_json()
     filename = data.get("filename")
     content = data.get("content")
 
     if not filename:
-        return jsonify({"error": "Missing filename"}), 400
+        return _ERR_MISSING_FILENAME
 
     if not content:
-        return jsonify({"error": "Missing content"}), 400
+        return _ERR_MISSING_CONTENT
 
-    # Ajouter l'extension .canvas si elle n'est pas présente
-    if not filename.endswith(".canvas"):
-        filename = f"{filename}.canvas"
+    filename = canvas_key(filename)
+    if filename is None:
+        return _ERR_INVALID_FILENAME
 
     try:
-        # Vérifier si le fichier existe déjà
-        try:
-            s3.head_object(Bucket=BUCKET, Key=filename)
-            return jsonify({"error": f"Canvas file '{filename}' already exists"}), 409
-        except s3.exceptions.ClientError:
-            pass
-
-        # Convertir en JSON si c'est un dict/list
-        import json
-        if isinstance(content, (dict, list)):
-            content_str = json.dumps(content, indent=2, ensure_ascii=False)
-        else:
-            content_str = str(content)
+        body, encoding = encode_canvas(content)
 
-        s3.put_object(
-            Bucket=BUCKET,
-            Key=filename,
-            Body=content_str.encode("utf-8"),
-            ContentType="application/json"
-        )
+        # Écriture conditionnelle : S3 refuse si le fichier existe déjà
+        try:
+            result = s3.put_object(
+                Bucket=BUCKET,
+                Key=filename,
+                Body=body,
+                ContentType="application/json",
+                IfNoneMatch="*",
+                **encoding
+            )
+        except s3.exceptions.ClientError as e:
+            if s3_error_code(e) in CONDITIONAL_WRITE_FAILURES:
+                return jsonify({"error": f"Canvas file '{filename}' already exists"}), 409
+            raise
+        invalidate_canvas(filename)
 
         return jsonify({
             "success": True,
             "message": f"Canvas '{filename}' created successfully",
             "filename": filename
-        }), 201
+        }), 201, {"ETag": result["ETag"]}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -345,46 +899,54 @@ def create_canvas():
 @app.route("/canvas/<path:filename>", methods=["PUT"])
 def update_canvas(filename):
     """Met à jour un fichier .canvas existant"""
-    auth_error = check_auth()
-    if auth_error:
-        return auth_error
-
     data = request.get_json()
     content = data.get("content")
 
     if not content:
-        return jsonify({"error": "Missing content"}), 400
+        return _ERR_MISSING_CONTENT
 
-    # Ajouter l'extension .canvas si elle n'est pas présente
-    if not filename.endswith(".canvas"):
-        filename = f"{filename}.canvas"
+    filename = canvas_key(filename)
+    if filename is None:
+        return _ERR_INVALID_FILENAME
 
     try:
-        # Vérifier si le fichier existe
-        try:
-            s3.head_object(Bucket=BUCKET, Key=filename)
-        except s3.exceptions.ClientError:
-            return jsonify({"error": f"Canvas file '{filename}' not found"}), 404
-
-        # Convertir en JSON si c'est un dict/list
-        import json
-        if isinstance(content, (dict, list)):
-            content_str = json.dumps(content, indent=2, ensure_ascii=False)
+        # Avec If-Match, S3 vérifie lui-même l'existence et la version du
+        # fichier ; sinon on vérifie l'existence avant d'écrire
+        if_match = request.headers.get("If-Match")
+        if if_match:
+            put_conditions = {"IfMatch": s3_if_match(if_match)}
         else:
-            content_str = str(content)
+            put_conditions = {}
+            try:
+                s3.head_object(Bucket=BUCKET, Key=filename)
+            except s3.exceptions.ClientError:
+                return jsonify({"error": f"Canvas file '{filename}' not found"}), 404
 
-        s3.put_object(
-            Bucket=BUCKET,
-            Key=filename,
-            Body=content_str.encode("utf-8"),
-            ContentType="application/json"
-        )
+        body, encoding = encode_canvas(content)
+
+        try:
+            result = s3.put_object(
+                Bucket=BUCKET,
+                Key=filename,
+                Body=body,
+                ContentType="application/json",
+                **encoding,
+                **put_conditions
+            )
+        except s3.exceptions.ClientError as e:
+            code = s3_error_code(e)
+            if code == "NoSuchKey":
+                return jsonify({"error": f"Canvas file '{filename}' not found"}), 404
+            if code in CONDITIONAL_WRITE_FAILURES:
+                return jsonify({"error": f"Canvas file '{filename}' has been modified"}), 412
+            raise
+        invalidate_canvas(filename)
 
         return jsonify({
             "success": True,
             "message": f"Canvas '{filename}' updated successfully",
             "filename": filename
-        })
+        }), 200, {"ETag": result["ETag"]}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -392,22 +954,14 @@ def update_canvas(filename):
 @app.route("/canvas/<path:filename>", methods=["DELETE"])
 def delete_canvas(filename):
     """Supprime un fichier .canvas"""
-    auth_error = check_auth()
-    if auth_error:
-        return auth_error
-
-    # Ajouter l'extension .canvas si elle n'est pas présente
-    if not filename.endswith(".canvas"):
-        filename = f"{filename}.canvas"
+    filename = canvas_key(filename)
+    if filename is None:
+        return _ERR_INVALID_FILENAME
 
     try:
-        # Vérifier si le fichier existe
-        try:
-            s3.head_object(Bucket=BUCKET, Key=filename)
-        except s3.exceptions.ClientError:
-            return jsonify({"error": f"Canvas file '{filename}' not found"}), 404
-
+        # La suppression S3 est idempotente : pas de vérification préalable
         s3.delete_object(Bucket=BUCKET, Key=filename)
+        invalidate_canvas(filename)
 
         return jsonify({
             "success": True,
@@ -416,8 +970,3 @@ def delete_canvas(filename):
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-
-
-if __name__ == "__main__":
-    port = int(os.getenv("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,15 @@
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+# Charger PORT et les réglages Gunicorn depuis .env
+load_dotenv()
+
+# Configuration Gunicorn : les handlers passent l'essentiel de leur temps
+# à attendre Storj, on multiplie donc workers et threads pour que les
+# appels S3 concurrents se chevauchent.
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+worker_class = "gthread"
+keepalive = 30
@@ -0,0 +1,84 @@
+import datetime
+import hashlib
+import io
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("STORJ_S3_BUCKET", "test-bucket")
+
+import app as storj_app  # noqa: E402
+
+
+class FakeS3:
+    """Client S3 en mémoire couvrant les appels utilisés par l'application"""
+
+    def __init__(self, real_client):
+        self.exceptions = real_client.exceptions
+        self.objects = {}
+
+    @staticmethod
+    def _error(code, status):
+        return ClientError({"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "S3")
+
+    def put_object(self, Bucket, Key, Body, ContentType="binary/octet-stream", IfMatch=None, IfNoneMatch=None, **kwargs):
+        current = self.objects.get(Key)
+        if IfNoneMatch == "*" and current is not None:
+            raise self._error("PreconditionFailed", 412)
+        if IfMatch is not None:
+            if current is None:
+                raise self._error("NoSuchKey", 404)
+            if IfMatch != current["ETag"]:
+                raise self._error("PreconditionFailed", 412)
+        etag = '"%s"' % hashlib.md5(Body).hexdigest()
+        self.objects[Key] = {
+            "Body": Body,
+            "ETag": etag,
+            "ContentType": ContentType,
+            "LastModified": datetime.datetime(2025, 1, 1),
+            **kwargs
+        }
+        return {"ETag": etag}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        obj = dict(self.objects[Key])
+        body = obj.pop("Body")
+        if Range is not None:
+            start, end = (int(bound) for bound in Range[len("bytes="):].split("-"))
+            if start >= len(body):
+                raise self._error("InvalidRange", 416)
+            obj["ContentRange"] = "bytes %d-%d/%d" % (start, min(end, len(body) - 1), len(body))
+            body = body[start:end + 1]
+        obj["Body"] = StreamingBody(io.BytesIO(body), len(body))
+        obj["ContentLength"] = len(body)
+        return obj
+
+    def head_object(self, Bucket, Key, **kwargs):
+        if Key not in self.objects:
+            raise self._error("404", 404)
+        obj = dict(self.objects[Key])
+        obj["ContentLength"] = len(obj.pop("Body"))
+        return obj
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop(Key, None)
+        return {}
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    fake = FakeS3(storj_app.s3)
+    monkeypatch.setattr(storj_app, "s3", fake)
+    with storj_app._canvas_cache_lock:
+        storj_app._canvas_cache.clear()
+    return fake
+
+
+@pytest.fixture
+def client(s3):
+    return storj_app.app.test_client()
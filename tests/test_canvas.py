@@ -0,0 +1,150 @@
+import app as storj_app
+
+
+GZIP = {"Accept-Encoding": "gzip"}
+
+# Canvas de plus de 1 Ko : la réponse est compressée et son ETag suffixé
+LARGE_CANVAS = {"nodes": [{"id": str(i), "text": "x" * 20} for i in range(100)], "edges": []}
+
+
+def test_put_with_etag_from_compressed_get(client):
+    created = client.post("/canvas", json={"filename": "big", "content": LARGE_CANVAS})
+    assert created.status_code == 201
+
+    read = client.get("/canvas/big", headers=GZIP)
+    assert read.headers["Content-Encoding"] == "gzip"
+    etag = read.headers["ETag"]
+    assert etag.endswith(':gzip"')
+
+    updated = client.put("/canvas/big", json={"content": {"nodes": []}}, headers={"If-Match": etag})
+    assert updated.status_code == 200
+
+    stale = client.put("/canvas/big", json={"content": {"nodes": [1]}}, headers={"If-Match": etag})
+    assert stale.status_code == 412
+
+
+def test_get_revalidates_compressed_etag(client):
+    client.post("/canvas", json={"filename": "big", "content": LARGE_CANVAS})
+    etag = client.get("/canvas/big", headers=GZIP).headers["ETag"]
+
+    revalidated = client.get("/canvas/big", headers={**GZIP, "If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["ETag"] == etag
+
+
+def test_read_racing_a_write_is_not_cached(client, s3, monkeypatch):
+    client.post("/canvas", json={"filename": "race", "content": {"v": 1}})
+    read_object = s3.get_object
+
+    def get_then_overwrite(**kwargs):
+        # L'ancienne version est lue, puis une écriture concurrente la remplace
+        old = read_object(**kwargs)
+        monkeypatch.setattr(s3, "get_object", read_object)
+        assert client.put("/canvas/race", json={"content": {"v": 2}}).status_code == 200
+        return old
+
+    monkeypatch.setattr(s3, "get_object", get_then_overwrite)
+    assert client.get("/canvas/race").get_json() == {"v": 1}
+    assert client.get("/canvas/race").get_json() == {"v": 2}
+
+
+def test_envelope_is_a_separate_representation(client):
+    client.post("/canvas", json={"filename": "env", "content": {"nodes": []}})
+    envelope_accept = {"Accept": "application/x-envelope+json"}
+
+    envelope = client.get("/canvas/env", headers=envelope_accept)
+    assert envelope.mimetype == "application/x-envelope+json"
+    assert envelope.get_json()["content"] == {"nodes": []}
+    assert "Accept" in envelope.headers["Vary"]
+
+    stored = client.get("/canvas/env")
+    assert stored.get_json() == {"nodes": []}
+    assert "Accept" in stored.headers["Vary"]
+    assert stored.headers["ETag"] != envelope.headers["ETag"]
+
+    # L'ETag de l'enveloppe ne valide pas le contenu stocké, et inversement
+    assert client.get("/canvas/env", headers={"If-None-Match": envelope.headers["ETag"]}).status_code == 200
+    revalidated = client.get("/canvas/env", headers={**envelope_accept, "If-None-Match": envelope.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+    # L'ETag de l'enveloppe reste utilisable pour une mise à jour conditionnelle
+    updated = client.put("/canvas/env", json={"content": {"nodes": [1]}}, headers={"If-Match": envelope.headers["ETag"]})
+    assert updated.status_code == 200
+
+
+def test_read_note_on_gzip_stored_canvas(client, monkeypatch):
+    monkeypatch.setattr(storj_app, "CANVAS_GZIP", True)
+    client.post("/canvas", json={"filename": "packed", "content": {"nodes": []}})
+
+    read = client.post("/readNote", json={"filename": "packed.canvas"})
+    assert read.status_code == 200
+    assert read.get_json()["content"] == '{"nodes":[]}'
+
+
+def test_gzip_stored_canvas_streams_follow_accept_encoding(client, s3, monkeypatch):
+    monkeypatch.setattr(storj_app, "CANVAS_GZIP", True)
+    # Au-delà de la taille maximale du cache : le canvas n'est pas mis en cache
+    monkeypatch.setattr(storj_app, "CANVAS_CACHE_MAX_OBJECT_SIZE", 0)
+    client.post("/canvas", json={"filename": "packed", "content": LARGE_CANVAS})
+    stored = storj_app.gzip.decompress(s3.objects["packed.canvas"]["Body"])
+
+    plain = client.get("/canvas/packed?raw=1")
+    assert "Content-Encoding" not in plain.headers
+    assert plain.data == stored
+
+    passthrough = client.get("/canvas/packed?raw=1", headers=GZIP)
+    assert passthrough.headers["Content-Encoding"] == "gzip"
+    assert storj_app.gzip.decompress(passthrough.data) == stored
+
+
+def test_range_on_gzip_stored_canvas_slices_decompressed_content(client, s3, monkeypatch):
+    monkeypatch.setattr(storj_app, "CANVAS_GZIP", True)
+    client.post("/canvas", json={"filename": "packed", "content": LARGE_CANVAS})
+    stored = storj_app.gzip.decompress(s3.objects["packed.canvas"]["Body"])
+
+    partial = client.get("/canvas/packed", headers={**GZIP, "Range": "bytes=0-9"})
+    assert partial.status_code == 206
+    assert "Content-Encoding" not in partial.headers
+    assert partial.data == stored[:10]
+    assert partial.headers["Content-Range"] == "bytes 0-9/%d" % len(stored)
+
+
+def test_range_past_compressed_length_on_gzip_stored_canvas(client, s3, monkeypatch):
+    monkeypatch.setattr(storj_app, "CANVAS_GZIP", True)
+    client.post("/canvas", json={"filename": "packed", "content": LARGE_CANVAS})
+    compressed = s3.objects["packed.canvas"]["Body"]
+    stored = storj_app.gzip.decompress(compressed)
+    start = len(compressed) + 10
+    byte_range = "bytes=%d-%d" % (start, start + 9)
+
+    # Lecture à froid (cache vidé), puis depuis le cache
+    with storj_app._canvas_cache_lock:
+        storj_app._canvas_cache.clear()
+    for _ in range(2):
+        partial = client.get("/canvas/packed", headers={"Range": byte_range})
+        assert partial.status_code == 206
+        assert partial.data == stored[start:start + 10]
+
+
+def test_streamed_canvas_carries_etag_and_revalidates(client, s3, monkeypatch):
+    # Au-delà de la taille maximale du cache : lecture directe depuis S3
+    monkeypatch.setattr(storj_app, "CANVAS_CACHE_MAX_OBJECT_SIZE", 0)
+    client.post("/canvas", json={"filename": "huge", "content": LARGE_CANVAS})
+    stored = s3.objects["huge.canvas"]
+
+    read = client.get("/canvas/huge")
+    assert read.status_code == 200
+    assert read.headers["ETag"] == stored["ETag"]
+    assert read.headers["X-Size"] == str(len(stored["Body"]))
+    assert read.headers["X-Last-Modified"] == stored["LastModified"].isoformat()
+
+    revalidated = client.get("/canvas/huge", headers={"If-None-Match": read.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+
+def test_cache_is_sized_in_bytes(client, s3):
+    client.post("/canvas", json={"filename": "big", "content": LARGE_CANVAS})
+    client.get("/canvas/big")
+
+    assert storj_app._canvas_cache.currsize == len(s3.objects["big.canvas"]["Body"])
+    assert storj_app._canvas_cache.maxsize == storj_app.CANVAS_CACHE_BYTES